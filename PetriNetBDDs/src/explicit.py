@@ -1,6 +1,13 @@
-from collections import deque
+import numpy as np
 from pnml_parser import PNModel   # sử dụng Task 1
 
+# Numba là tùy chọn: nếu không có thì dùng BFS NumPy
+try:
+    from numba import njit, types
+    from numba.typed import Dict
+except ImportError:
+    njit = None
+
 
 # ----------------------
 #  Kiểm tra enabled
@@ -30,28 +37,212 @@ def fire(model, marking, tid):
 
 
 # ----------------------
-#  EXPLORE EXPLICIT RG
+#  Mã hóa marking dạng bitmask
+# ----------------------
+def build_consumers(model):
+    # consumers[i]: bitmask các transition (vị trí trong model.trans_vec) lấy token từ place bit i
+    consumers = [0] * len(model.place_index)
+    free = 0   # các transition không có input place -> luôn enabled
+
+    for j, trec in enumerate(model.trans_vec):
+        if not trec.pre_mask:
+            free |= 1 << j
+    for p, i in model.place_index.items():
+        for tid in model.places[p].outputs:
+            consumers[i] |= 1 << model.trans_index[tid]
+
+    return consumers, free
+
+
+def enabled_transitions(M, trans_vec, consumers, free):
+    # Chỉ kiểm tra các transition có input place nằm trong M
+    cand = free
+    i = 0
+    m = M
+    while m:
+        if m & 1:
+            cand |= consumers[i]
+        m >>= 1
+        i += 1
+
+    result = []
+    j = 0
+    while cand:
+        if cand & 1:
+            trec = trans_vec[j]
+            if M & trec.pre_mask == trec.pre_mask:
+                result.append(trec)
+        cand >>= 1
+        j += 1
+    return result
+
+
+def bits_to_frozenset(place_index, mask):
+    return frozenset(p for p, i in place_index.items() if mask >> i & 1)
+
+
 # ----------------------
-def explicit_reachability(model):
-    M0 = frozenset(p for p in model.places if model.places[p].marked)
+#  BFS theo từng tầng (NumPy, <= 64 places)
+# ----------------------
+def frontier_bfs_numpy(trans_vec, M0):
+    # Mỗi marking là một uint64; xử lý cả frontier cùng lúc bằng broadcasting
+    pre = np.array([trec.pre_mask for trec in trans_vec], dtype=np.uint64)
+    rem = np.array([trec.rem_mask for trec in trans_vec], dtype=np.uint64)
+    post = np.array([trec.post_mask for trec in trans_vec], dtype=np.uint64)
 
     visited = {M0}
-    queue = deque([M0])
-    edges = []   # (M, t, M')
+    dead = []
+    frontier = np.array([M0], dtype=np.uint64)
+
+    while frontier.size:
+        F = frontier[:, None]
+        enabled = (F & pre) == pre                  # |frontier| x |T|
+        dead.extend(frontier[~enabled.any(axis=1)].tolist())
+
+        succ = np.unique(((F ^ rem) | post)[enabled])
+        new = [M2 for M2 in succ.tolist() if M2 not in visited]
+        visited.update(new)
+        frontier = np.array(new, dtype=np.uint64)
+
+    return visited, dead
+
+
+# ----------------------
+#  BFS theo từng tầng (NumPy, > 64 places)
+# ----------------------
+def to_words(mask, n_words):
+    # Tách bitmask thành n_words từ uint64 (từ thấp -> cao)
+    return [(mask >> (64 * k)) & 0xFFFFFFFFFFFFFFFF for k in range(n_words)]
+
+
+def from_words(words):
+    mask = 0
+    for k, w in enumerate(words):
+        mask |= w << (64 * k)
+    return mask
+
+
+def frontier_bfs_words(trans_vec, M0, n_places):
+    # Marking là một hàng n_words x uint64; transition enabled khi mọi từ thỏa (F & pre) == pre
+    n_words = (n_places + 63) // 64
+    pre = np.array([to_words(trec.pre_mask, n_words) for trec in trans_vec], dtype=np.uint64).reshape(-1, n_words)
+    rem = np.array([to_words(trec.rem_mask, n_words) for trec in trans_vec], dtype=np.uint64).reshape(-1, n_words)
+    post = np.array([to_words(trec.post_mask, n_words) for trec in trans_vec], dtype=np.uint64).reshape(-1, n_words)
+
+    start = tuple(to_words(M0, n_words))
+    visited = {start}
+    dead = []
+    frontier = np.array([start], dtype=np.uint64)
+
+    while len(frontier):
+        F = frontier[:, None, :]
+        enabled = ((F & pre) == pre).all(axis=2)   # |frontier| x |T|
+        dead.extend(map(tuple, frontier[~enabled.any(axis=1)].tolist()))
+
+        succ = np.unique(((F ^ rem) | post)[enabled], axis=0)
+        new = [M2 for M2 in map(tuple, succ.tolist()) if M2 not in visited]
+        visited.update(new)
+        frontier = np.array(new, dtype=np.uint64).reshape(-1, n_words)
+
+    return {from_words(M) for M in visited}, [from_words(M) for M in dead]
+
+
+# ----------------------
+#  BFS biên dịch bằng Numba (<= 64 places)
+# ----------------------
+if njit is not None:
+    @njit(cache=True)
+    def bfs_kernel_numba(M0, pre, rem, post):
+        visited = Dict.empty(key_type=types.uint64, value_type=types.uint8)
+        visited[M0] = np.uint8(1)
+        queue = [M0]
+        dead = [M0][:0]
+        head = 0
+
+        while head < len(queue):
+            M = queue[head]
+            head += 1
+            has_enabled = False
+            for j in range(pre.shape[0]):
+                if M & pre[j] == pre[j]:
+                    has_enabled = True
+                    M2 = (M ^ rem[j]) | post[j]
+                    if M2 not in visited:
+                        visited[M2] = np.uint8(1)
+                        queue.append(M2)
+            if not has_enabled:
+                dead.append(M)
+
+        return np.array(queue, dtype=np.uint64), np.array(dead, dtype=np.uint64)
+
+
+def bfs_numba(trans_vec, M0):
+    pre = np.array([trec.pre_mask for trec in trans_vec], dtype=np.uint64)
+    rem = np.array([trec.rem_mask for trec in trans_vec], dtype=np.uint64)
+    post = np.array([trec.post_mask for trec in trans_vec], dtype=np.uint64)
+
+    # queue chứa mỗi marking đúng một lần -> chính là tập visited
+    states, dead = bfs_kernel_numba(np.uint64(M0), pre, rem, post)
+    return set(states.tolist()), dead.tolist()
+
+
+# ----------------------
+#  EXPLORE EXPLICIT RG
+# ----------------------
+def explicit_reachability(model, with_deadlocks=False, record_edges=False):
+    place_index = model.place_index
+    trans_vec = model.trans_vec
+
+    M0 = 0
+    for p in model.places:
+        if model.places[p].marked:
+            M0 |= 1 << place_index[p]
+
+    edges = None
+
+    if not record_edges and len(place_index) <= 64:
+        if njit is not None:
+            visited, dead = bfs_numba(trans_vec, M0)
+        else:
+            visited, dead = frontier_bfs_numpy(trans_vec, M0)
+    elif not record_edges:
+        visited, dead = frontier_bfs_words(trans_vec, M0, len(place_index))
+    else:
+        consumers, free = build_consumers(model)
+        edges = []   # (M, t, M') dạng bitmask
+        visited = {M0}
+        frontier = [M0]
+        dead = []   # deadlock ghi lại ngay trong lúc BFS
+
+        # BFS theo tầng với hai list (frontier / nxt) thay cho deque.popleft
+        while frontier:
+            nxt = []
+            for M in frontier:
+                enabled = enabled_transitions(M, trans_vec, consumers, free)
+                if not enabled:
+                    dead.append(M)
+
+                for trec in enabled:
+                    # trec enabled => rem_mask ⊆ M, nên XOR xóa đúng các token bị tiêu thụ
+                    M2 = (M ^ trec.rem_mask) | trec.post_mask
+                    edges.append((M, trec.tid, M2))
 
-    while queue:
-        M = queue.popleft()
+                    if M2 not in visited:
+                        visited.add(M2)
+                        nxt.append(M2)
+            frontier = nxt
 
-        for tid in model.transitions:
-            if is_enabled(model, M, tid):
-                M2 = fire(model, M, tid)
-                edges.append((M, tid, M2))
+    # Chuyển lại về frozenset cho các Task khác
+    to_set = {M: bits_to_frozenset(place_index, M) for M in visited}
+    states = set(to_set.values())
+    if record_edges:
+        edges = [(to_set[M], tid, to_set[M2]) for M, tid, M2 in edges]
 
-                if M2 not in visited:
-                    visited.add(M2)
-                    queue.append(M2)
+    if with_deadlocks:
+        deadlocks = [to_set[M] for M in dead]
+        return states, edges, deadlocks
 
-    return visited, edges
+    return states, edges
 
 
 # ----------------------
@@ -60,7 +251,7 @@ def explicit_reachability(model):
 if __name__ == "__main__":
     model = PNModel.load_pnml("example.pnml")
 
-    states, edges = explicit_reachability(model)
+    states, edges, deadlocks = explicit_reachability(model, with_deadlocks=True, record_edges=True)
 
     print("\n===== EXPLICIT REACHABILITY =====")
     print("Reachable Markings:", len(states))
@@ -69,7 +260,5 @@ if __name__ == "__main__":
         print(f"{sorted(M)} --{t}--> {sorted(M2)}")
 
     print("\n===== DEADLOCK STATES =====")
-    for M in states:
-        enabled_list = [t for t in model.transitions if is_enabled(model, M, t)]
-        if len(enabled_list) == 0:
-            print("Deadlock:", sorted(M))
+    for M in deadlocks:
+        print("Deadlock:", sorted(M))
@@ -1,14 +1,20 @@
-import pulp
-from typing import Dict, List, Tuple, Any, Optional, FrozenSet
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Dict, List, Tuple, Any, Optional, FrozenSet
 import numpy as np
+from functools import cached_property, lru_cache
 import sys
 import os 
 
 # --- IMPORT CÁC THÀNH PHẦN TỪ TASK 1 & 3 ---
-try:
+# pulp và SymbolicAnalyzer (kéo theo dd) được import trễ trong hàm cần chúng
+# để khởi động CLI nhanh (vd. khi file không tồn tại)
+if TYPE_CHECKING:
+    import pulp
     from dd.autoref import BDD
+
+try:
     from pnml_parser import PNModel # Từ Task 1
-    from symbolic import SymbolicAnalyzer # Từ Task 3
 
 except ImportError as e:
     print(f"LỖI THIẾU MODULE: Không tìm thấy lớp hoặc thư viện cần thiết.")
@@ -22,24 +28,20 @@ except ImportError as e:
 
 # Thêm phương thức tính Ma trận Sự cố vào lớp PNModel
 def _build_incidence_matrix(self: PNModel) -> np.ndarray:
-    """Tính toán và trả về Ma trận sự cố A = Post - Pre."""
-    sorted_places = sorted(self.places.keys())
-    sorted_transitions = sorted(self.transitions.keys())
-    n_places = len(sorted_places)
-    n_trans = len(sorted_transitions)
-    A = np.zeros((n_places, n_trans), dtype=int)
-    
-    p_idx = {p: i for i, p in enumerate(sorted_places)}
-    
-    for p_id in sorted_places:
-        i = p_idx[p_id]
-        for j, t_id in enumerate(sorted_transitions):
-            post_val = 1 if t_id in self.places[p_id].inputs else 0
-            pre_val = 1 if t_id in self.places[p_id].outputs else 0
-            A[i, j] = post_val - pre_val
+    """Tính toán và trả về Ma trận sự cố A = Post - Pre (scatter từ các mảng CSR của PNModel)."""
+    n_trans = len(self.sorted_transitions)
+    A = np.zeros((len(self.sorted_places), n_trans), dtype=np.int8)
+
+    # Cột của từng phần tử CSR: transition j lặp lại |pre(j)| (hoặc |post(j)|) lần
+    pre_cols = np.repeat(np.arange(n_trans), np.diff(self.pre_indptr))
+    post_cols = np.repeat(np.arange(n_trans), np.diff(self.post_indptr))
+    A[self.post_indices, post_cols] += 1
+    A[self.pre_indices, pre_cols] -= 1
     return A
 
-PNModel.incidence_matrix = property(_build_incidence_matrix)
+# Mô hình không thay đổi sau khi parse -> chỉ tính ma trận một lần
+PNModel.incidence_matrix = cached_property(_build_incidence_matrix)
+PNModel.incidence_matrix.__set_name__(PNModel, "incidence_matrix")
 
 
 # ====================================================================
@@ -47,8 +49,17 @@ PNModel.incidence_matrix = property(_build_incidence_matrix)
 # ====================================================================
 
 def get_bdd_reach_data(model: PNModel) -> Tuple[BDD, Any, Dict[str, str]]:
-    """Chạy SymbolicAnalyzer (Task 3) để lấy BDD Reachable Set và cấu hình BDD."""
+    """Chạy SymbolicAnalyzer (Task 3) để lấy BDD Reachable Set và cấu hình BDD.
+
+    Kết quả được lưu trên model, các lần gọi sau (cùng model) dùng lại mà không chạy lại Task 3.
+    """
+    cached = getattr(model, "_bdd_reach_data", None)
+    if cached is not None:
+        return cached
+
     print("\n[TASK 3] Bắt đầu chạy Symbolic Analyzer...")
+    from symbolic import SymbolicAnalyzer # Từ Task 3
+
     analyzer = SymbolicAnalyzer(model)
     results = analyzer.analyze()
     
@@ -58,69 +69,242 @@ def get_bdd_reach_data(model: PNModel) -> Tuple[BDD, Any, Dict[str, str]]:
     
     print(f"[TASK 3] Phân tích hoàn tất. BDD Nodes: {results['bdd_node_count']}. Markings: {results['num_markings']}")
     # NOTE: Kết quả của SymbolicAnalyzer (Task 3) vẫn bao gồm thời gian, nhưng chúng ta chỉ loại bỏ việc tính thời gian trong Task 5.
-    return bdd_instance, reachable_bdd, place_vars
+    model._bdd_reach_data = (bdd_instance, reachable_bdd, place_vars)
+    return model._bdd_reach_data
 
 def is_reachable_bdd(marking_dict: Dict[str, int], bdd_reach: Any, place_vars: Dict[str, str], bdd_instance: BDD) -> bool:
-    """Kiểm tra Marking (M) có thỏa mãn BDD (Reach(M0)) không."""
-    fs_marking = frozenset(p for p, val in marking_dict.items() if val == 1)
-    marking_bdd = bdd_instance.true
-    
-    for place_id, var_name in place_vars.items():
-        var = bdd_instance.var(var_name)
-        if place_id in fs_marking:
-            marking_bdd = marking_bdd & var
+    """Kiểm tra Marking (M) có thỏa mãn BDD (Reach(M0)) không.
+
+    Gán toàn bộ biến theo M vào bdd_reach (cofactor) bằng một lần `let`,
+    kết quả là một hằng true/false - không cần dựng BDD của M rồi AND.
+    """
+    assignment = {var_name: marking_dict.get(place_id, 0) == 1 for place_id, var_name in place_vars.items()}
+    return bdd_instance.let(assignment, bdd_reach) == bdd_instance.true
+
+def unreachable_support(marking_dict: Dict[str, int], bdd_reach: Any, place_vars: Dict[str, str],
+                        bdd_instance: BDD) -> Optional[List[str]]:
+    """Tìm tập place S trong support của M sao cho không marking reachable nào đánh dấu đủ S.
+
+    Chỉ gán các biến của S = 1 (các biến khác tự do); nếu cofactor là false thì mọi
+    marking chứa S đều không reachable. S được thu nhỏ tham lam (bỏ từng place khi vẫn
+    false) để cut loại được càng nhiều marking càng tốt. Trả về None nếu không có S.
+    """
+    support = [p for p, v in marking_dict.items() if v == 1]
+    assignment = {place_vars[p]: True for p in support}
+    if not support or bdd_instance.let(assignment, bdd_reach) != bdd_instance.false:
+        return None
+    for p in list(support):
+        del assignment[place_vars[p]]
+        if assignment and bdd_instance.let(assignment, bdd_reach) == bdd_instance.false:
+            support.remove(p)
         else:
-            marking_bdd = marking_bdd & ~var
+            assignment[place_vars[p]] = True
+    return support
 
-    return (marking_bdd & bdd_reach) != bdd_instance.false
+# Reach(M0) nhỏ hơn ngưỡng này thì liệt kê trực tiếp từ BDD thay vì gọi ILP
+ENUMERATION_THRESHOLD = 2 ** 16
+# Số cut tối đa trước khi bỏ cuộc (mỗi cut loại ít nhất một nghiệm giả của state equation)
+MAX_NO_GOOD_CUTS = 100
 
-# Cập nhật signature: Loại bỏ tham số float (runtime)
-def optimize_reachable(model: PNModel, c: Dict[str, int], timeout: int = 60) -> Tuple[Optional[Dict[str, int]], str]:
-    """Task 5: Tối ưu hóa max c^T M, M in Reach(M0)."""
-    
-    # 1. Lấy đầu ra BDD (Thực thi Task 3)
-    bdd_instance, bdd_reach, place_vars = get_bdd_reach_data(model)
+def optimize_by_enumeration(c: Dict[str, int], bdd_reach: Any, place_vars: Dict[str, str],
+                            bdd_instance: BDD, places: List[str]) -> Dict[str, int]:
+    """Duyệt mọi marking trong Reach(M0) (BDD) và chọn marking có c^T M lớn nhất."""
+    # Xếp các marking thành ma trận R[i, p] (uint8) rồi tính R @ c một lần
+    var_order = [place_vars[p] for p in places]
+    R = np.array([[assignment[v] for v in var_order]
+                  for assignment in bdd_instance.pick_iter(bdd_reach, care_vars=set(var_order))],
+                 dtype=np.uint8).reshape(-1, len(places))
     
-    # 2. Setup ILP
-    places = sorted(model.places.keys())
-    transitions = sorted(model.transitions.keys())
+    c_vec = np.array([c.get(p, 0) for p in places], dtype=np.int64)
+    best = int(np.argmax(R @ c_vec))   # argmax: marking đầu tiên đạt max, như vòng lặp cũ
+    return dict(zip(places, R[best].tolist()))
+
+def build_state_equation_problem(model: PNModel, c: Dict[str, int], places: List[str],
+                                 transitions: List[str]) -> Tuple[pulp.LpProblem, Dict[str, Any], Dict[str, Any]]:
+    """Dựng bài toán max c^T M với M = M0 + A * sigma.
+
+    sigma_vars chỉ chứa một đại diện cho mỗi cột phân biệt (khác 0) của A.
+    """
+    import pulp
+
     A = model.incidence_matrix
+    
+    # Transition có cột A giống hệt nhau (cùng Pre - Post) chỉ cần một biến sigma,
+    # cột toàn 0 (vd. self-loop) không ảnh hưởng state equation -> bỏ
+    _, first = np.unique(A, axis=1, return_index=True)
+    cols_kept = np.sort(first)
+    cols_kept = cols_kept[A[:, cols_kept].any(axis=0)]
+    A = A[:, cols_kept]
+    transitions = [transitions[j] for j in cols_kept]
+    
     prob = pulp.LpProblem("Petri_Optimization", pulp.LpMaximize)
     
     M_vars = pulp.LpVariable.dicts("M", places, lowBound=0, upBound=1, cat=pulp.LpBinary)
     sigma_vars = pulp.LpVariable.dicts("sigma", transitions, lowBound=0, cat=pulp.LpInteger)
     
-    # 3. Objective: max sum c_p * M_p
-    prob += pulp.lpSum(c.get(p, 0) * M_vars[p] for p in places)
+    # Objective: max sum c_p * M_p (chỉ các hệ số khác 0)
+    prob += pulp.LpAffineExpression([(M_vars[p], c[p]) for p in places if c.get(p, 0)])
     
-    # 4. Constraints: State Equation M = M0 + A * sigma
+    # Constraints: State Equation M = M0 + A * sigma
+    # Chỉ duyệt các phần tử khác 0 của A (ma trận rất thưa): lấy toàn bộ một lần
+    # theo thứ tự hàng, rồi cắt theo biên của từng hàng;
+    # biến sigma tra theo chỉ số cột, không tra dict theo tên trong vòng lặp
+    sigma_list = [sigma_vars[t] for t in transitions]
+    nz_rows, nz_cols = np.nonzero(A)
+    nz_terms = [(sigma_list[j], v) for j, v in zip(nz_cols.tolist(), A[nz_rows, nz_cols].tolist())]
+    row_bounds = np.searchsorted(nz_rows, np.arange(len(places) + 1)).tolist()
     for i, p in enumerate(places):
         M0_p = 1 if model.places[p].marked else 0 
-        prob += M_vars[p] == M0_p + pulp.lpSum(A[i, j] * sigma_vars[t] 
-                                               for j, t in enumerate(transitions)), f"State_Eq_{p}"
+        terms = pulp.LpAffineExpression(nz_terms[row_bounds[i]:row_bounds[i + 1]])
+        prob += M_vars[p] == M0_p + terms, f"State_Eq_{p}"
     
-    # 5. Solve & Verify
-    print("Bắt đầu giải ILP...")
+    return prob, M_vars, sigma_vars
+
+@lru_cache(maxsize=None)
+def _highs_available() -> bool:
+    import pulp
+
+    return pulp.HiGHS().available()
+
+def make_solver(timeout: int, threads: Optional[int] = None, gap_rel: Optional[float] = None, mip: bool = True,
+                warm_start: bool = False):
+    """Chọn solver cho PuLP: HiGHS chạy ngay trong tiến trình (highspy) nếu có,
+    ngược lại CBC (mỗi lần giải khởi động một tiến trình con và ghi file .mps).
+    mip=False: chỉ giải LP relaxation (bỏ qua tính nguyên của biến).
+    warm_start=True: CBC nhận giá trị hiện tại của các biến làm MIP start (file .mst)."""
+    import pulp
+
+    if _highs_available():
+        return pulp.HiGHS(mip=mip, msg=0, timeLimit=timeout, threads=threads, gapRel=gap_rel)
+    return pulp.PULP_CBC_CMD(mip=mip, msg=0, timeLimit=timeout, threads=threads, gapRel=gap_rel,
+                             warmStart=warm_start)
+
+def _highs_resolve(solver: Any, prob: Any, constraint: Any) -> int:
+    """Thêm một ràng buộc vào mô hình highspy còn giữ trên prob (prob.solverModel)
+    rồi giải lại ngay trong tiến trình - prob.solve sẽ dựng lại toàn bộ mô hình."""
+    import highspy
+
+    inf = highspy.kHighsInf
+    indices, coefficients = zip(*((var.index, coef) for var, coef in constraint.items() if coef != 0))
+    lb, ub = constraint.getLb(), constraint.getUb()
+    constraint.index = prob.solverModel.getNumRow()
+    prob.solverModel.addRow(-inf if lb is None else lb, inf if ub is None else ub,
+                            len(indices), indices, coefficients)
+    solver.callSolver(prob)
+    status, sol_status = solver.findSolutionValues(prob)
+    prob.assignStatus(status, sol_status)
+    return status
+
+def _values(variables: List[Any]) -> np.ndarray:
+    """Giá trị nghiệm của các biến thành một mảng float64 (biến chưa có giá trị -> 0)."""
+    return np.fromiter((v.varValue or 0.0 for v in variables), dtype=np.float64, count=len(variables))
+
+def _is_integral(values: np.ndarray, tol: float = 1e-6) -> bool:
+    """Mọi giá trị đều nguyên (trong sai số tol)."""
+    return bool(np.all(np.abs(values - np.rint(values)) <= tol))
+
+# Cập nhật signature: Loại bỏ tham số float (runtime)
+def optimize_reachable(model: PNModel, c: Dict[str, int], timeout: int = 60,
+                       threads: Optional[int] = None, gap_rel: Optional[float] = None) -> Tuple[Optional[Dict[str, int]], str]:
+    """Task 5: Tối ưu hóa max c^T M, M in Reach(M0).
+
+    threads: số luồng solver (mặc định: số CPU). gap_rel: sai số tương đối cho phép
+    của solver (mặc định None = giải chính xác). Solver: xem make_solver.
+    """
+    
+    # 1. Lấy đầu ra BDD (Thực thi Task 3)
+    bdd_instance, bdd_reach, place_vars = get_bdd_reach_data(model)
+    # list(): LpVariable.dicts đọc tuple như chỉ số nhiều chiều
+    places = list(model.sorted_places)
+    
+    # Reach(M0) nhỏ: liệt kê trực tiếp, không cần ILP và bước kiểm tra BDD
+    num_reachable = int(bdd_instance.count(bdd_reach, nvars=len(place_vars)))
+    if num_reachable <= ENUMERATION_THRESHOLD:
+        log_messages = f"Reach(M0) có {num_reachable} marking: liệt kê trực tiếp từ BDD (bỏ qua ILP)\n"
+        return optimize_by_enumeration(c, bdd_reach, place_vars, bdd_instance, places), log_messages
     
-    status = prob.solve(pulp.PULP_CBC_CMD(msg=0, timeLimit=timeout))  
+    import pulp
+
+    # 2. Dựng mô hình một lần, dùng cho cả LP relaxation lẫn ILP
+    transitions = list(model.sorted_transitions)
+    prob, M_vars, sigma_vars = build_state_equation_problem(model, c, places, transitions)
+    
+    if threads is None:
+        threads = os.cpu_count() or 1
+    
+    milp_solver = None
     
-    log_messages = f"ILP Solver Status: {pulp.LpStatus[status]}\n"
+    def solve_milp(warm_start: bool = False) -> int:
+        nonlocal milp_solver
+        milp_solver = make_solver(timeout, threads, gap_rel, warm_start=warm_start)
+        try:
+            return prob.solve(milp_solver)
+        except pulp.PulpSolverError:
+            # Một số bản CBC không hỗ trợ đa luồng -> giải lại đơn luồng
+            milp_solver = make_solver(timeout, gap_rel=gap_rel, warm_start=warm_start)
+            return prob.solve(milp_solver)
     
-    if status != pulp.LpStatusOptimal:
-        log_messages += f"Không tìm thấy kết quả tối ưu. Trạng thái: {pulp.LpStatus[status]}\n"
-        # Trả về None và log
-        return None, log_messages
+    # 3. Cận trên từ LP relaxation: nếu nghiệm LP đã nguyên thì nó cũng tối ưu cho ILP
+    lp_status = prob.solve(make_solver(timeout, mip=False))
     
-    optimal_M = {p: int(M_vars[p].value()) for p in places}
+    M_list = [M_vars[p] for p in places]
+    sigma_list = list(sigma_vars.values())
     
-    # Verify với BDD (kết hợp Task 3)
-    if not is_reachable_bdd(optimal_M, bdd_reach, place_vars, bdd_instance):
-        log_messages += "Lỗi: Giải pháp ILP (State Equation) không thỏa mãn BDD Reachability.\n"
-        # Trả về None và log
-        return None, log_messages
+    if (lp_status == pulp.LpStatusOptimal and _is_integral(_values(M_list))
+            and _is_integral(_values(sigma_list))):
+        status = lp_status
+        log_messages = f"ILP Solver Status: {pulp.LpStatus[status]} (nghiệm LP relaxation đã nguyên, bỏ qua MILP)\n"
+    else:
+        # 4. Giải ILP trên cùng mô hình
+        print("Bắt đầu giải ILP...")
+        status = solve_milp()
+        log_messages = f"ILP Solver Status: {pulp.LpStatus[status]}\n"
     
-    # Trả về kết quả và log
-    return optimal_M, log_messages
+    # 5. Verify với BDD (kết hợp Task 3); marking không reachable (nghiệm giả của
+    # state equation) bị loại bằng support cut hoặc no-good cut rồi giải lại trên cùng mô hình
+    num_cuts = 0
+    while True:
+        if status != pulp.LpStatusOptimal:
+            log_messages += f"Không tìm thấy kết quả tối ưu. Trạng thái: {pulp.LpStatus[status]}\n"
+            # Trả về None và log
+            return None, log_messages
+        
+        optimal_M = dict(zip(places, np.rint(_values(M_list)).astype(np.int64).tolist()))
+        
+        if is_reachable_bdd(optimal_M, bdd_reach, place_vars, bdd_instance):
+            # Trả về kết quả và log
+            return optimal_M, log_messages
+        
+        if num_cuts >= MAX_NO_GOOD_CUTS:
+            log_messages += "Lỗi: Giải pháp ILP (State Equation) không thỏa mãn BDD Reachability.\n"
+            # Trả về None và log
+            return None, log_messages
+        
+        # Các ràng buộc cũ giữ nguyên, chỉ thêm đúng một hàng mới.
+        support = unreachable_support(optimal_M, bdd_reach, place_vars, bdd_instance)
+        if support is not None:
+            # Support cut: sum_{p in S} M_p <= |S| - 1, loại mọi marking chứa S
+            cut = pulp.LpAffineExpression([(M_vars[p], 1) for p in support])
+            constraint = cut <= len(support) - 1
+            prob += constraint, f"Support_Cut_{num_cuts}"
+            kind = f"support cut |S|={len(support)}"
+        else:
+            # No-good cut: sum_{M*_p=1} (1 - M_p) + sum_{M*_p=0} M_p >= 1.
+            ones = sum(optimal_M.values())
+            cut = pulp.LpAffineExpression([(M_vars[p], -1 if optimal_M[p] else 1) for p in places])
+            constraint = cut >= 1 - ones
+            prob += constraint, f"No_Good_{num_cuts}"
+            kind = "no-good cut"
+        num_cuts += 1
+        
+        if isinstance(milp_solver, pulp.HiGHS):
+            # HiGHS: mô hình MILP vẫn nằm trong bộ nhớ, chỉ thêm hàng cut rồi giải lại
+            status = _highs_resolve(milp_solver, prob, constraint)
+        else:
+            # CBC: nghiệm vừa bị loại vẫn nằm trong các biến, dùng làm MIP start
+            # (CBC sửa nó thành incumbent khả thi gần đó thay vì bắt đầu từ đầu)
+            status = solve_milp(warm_start=True)
+        log_messages += f"Cut #{num_cuts} ({kind}): loại marking không reachable, giải lại ILP ({pulp.LpStatus[status]})\n"
 
 # ====================================================================
 # PHẦN CHẠY VÍ DỤ (MỤC TIÊU CỤ THỂ)
@@ -148,19 +332,21 @@ if __name__ == "__main__":
     if model:
         # 2. ĐỊNH NGHĨA HÀM MỤC TIÊU CỤ THỂ
         c: Dict[str, int] = {}
-        is_mutex_net = any(p.startswith('c') for p in model.places.keys())
+        is_mutex_net = any(p[:1] == 'c' for p in model.places)
         
         if is_mutex_net:
-            for p in sorted(model.places.keys()):
-                if p.startswith('c'): c[p] = 10
-                elif p.startswith('r'): c[p] = 2
-                else: c[p] = 1
+            # Trọng số theo ký tự đầu: c (critical) = 10, r (request) = 2, còn lại = 1
+            weight_by_prefix = {'c': 10, 'r': 2}
+            c = {p: weight_by_prefix.get(p[:1], 1) for p in model.sorted_places}
             objective_desc = "Maximize (10 * Tokens in CS + 2 * Tokens in Request + 1 * Tokens in Idle/Mutex)."
             
         else:
-            for p in sorted(model.places.keys()): c[p] = 1
+            for p in model.sorted_places: c[p] = 1
             objective_desc = "Maximize tổng số tokens (c = 1 cho tất cả places)."
         
+        # Vector trọng số theo thứ tự model.sorted_places (dùng để tính c^T M)
+        c_vec = np.array([c[p] for p in model.sorted_places], dtype=np.int64)
+        
         output_content += f"Hàm Mục tiêu: {objective_desc}\n"
         output_content += f"Trọng số chi tiết: {c}\n"
         
@@ -174,7 +360,8 @@ if __name__ == "__main__":
         # 4. Báo cáo Kết quả cuối cùng
         output_content += "\n--- KẾT QUẢ TỐI ƯU HÓA CUỐI CÙNG ---\n"
         if result:
-            objective_value = sum(c[p] * v for p, v in result.items())
+            M_vec = np.array([result[p] for p in model.sorted_places], dtype=np.int64)
+            objective_value = int(np.dot(c_vec, M_vec))
             output_content += f"Marking tối ưu (M*): {result}\n"
             output_content += f"Giá trị Hàm Mục tiêu tối đa: {objective_value}\n"
         else:
@@ -5,6 +5,8 @@ Uses lxml as in the original.
 """
 
 from lxml import etree
+from collections import namedtuple
+import numpy as np
 import sys
 
 class Place:
@@ -20,53 +22,110 @@ class Transition:
         self.inputs = []
         self.outputs = []
 
+# Immutable per-transition record used by the analysis hot loops
+TransitionRec = namedtuple("TransitionRec", ["tid", "inputs", "outputs", "pre_mask", "post_mask", "rem_mask"])
+
 class PNModel:
     def __init__(self):
         self.places = {}
         self.transitions = {}
         self.arcs = []
+        self.sorted_places = ()        # place ids, sorted once
+        self.sorted_transitions = ()   # transition ids, sorted once
+        self.place_index = {}   # place id -> bit index (sorted order)
+        self.trans_vec = ()     # tuple of TransitionRec (sorted by id)
+        self.trans_index = {}   # transition id -> position in trans_vec
+        # CSR (SoA) view: place indices of transition j's preset are
+        # pre_indices[pre_indptr[j]:pre_indptr[j+1]]; likewise for the postset
+        self.pre_indptr = self.pre_indices = None
+        self.post_indptr = self.post_indices = None
+
+    def freeze(self):
+        """Precompute index-based views of the net once parsing is complete."""
+        self.sorted_places = tuple(sorted(self.places))
+        self.sorted_transitions = tuple(sorted(self.transitions))
+        self.place_index = {p: i for i, p in enumerate(self.sorted_places)}
+
+        # Adjacency is fixed after parsing: frozensets give O(1) membership tests
+        for node in (*self.places.values(), *self.transitions.values()):
+            node.inputs = frozenset(node.inputs)
+            node.outputs = frozenset(node.outputs)
+
+        pre_indptr, pre_indices = [0], []
+        post_indptr, post_indices = [0], []
+        recs = []
+        for tid in self.sorted_transitions:
+            t = self.transitions[tid]
+            pre = sorted(self.place_index[p] for p in t.inputs)
+            post = sorted(self.place_index[p] for p in t.outputs)
+            pre_indices.extend(pre); pre_indptr.append(len(pre_indices))
+            post_indices.extend(post); post_indptr.append(len(post_indices))
+
+            pre_mask = sum(1 << i for i in pre)
+            post_mask = sum(1 << i for i in post)
+            # rem_mask: input places that do not get their token back (pre \ post)
+            rem_mask = pre_mask & ~post_mask
+            recs.append(TransitionRec(tid, t.inputs, t.outputs, pre_mask, post_mask, rem_mask))
+
+        self.trans_vec = tuple(recs)
+        self.trans_index = {rec.tid: j for j, rec in enumerate(self.trans_vec)}
+        self.pre_indptr = np.array(pre_indptr, dtype=np.int32)
+        self.pre_indices = np.array(pre_indices, dtype=np.int32)
+        self.post_indptr = np.array(post_indptr, dtype=np.int32)
+        self.post_indices = np.array(post_indices, dtype=np.int32)
 
     @staticmethod
     def load_pnml(path):
         print(f"Loading PNML file: {path}")
         model = PNModel()
 
-        # Parse XML
+        # Parse XML in a single streaming pass, only stopping at place/transition/arc.
+        # Ids are interned so arcs, adjacency sets and markings share one str object per id.
         try:
-            xml = etree.parse(path).getroot()
+            for _, el in etree.iterparse(path, events=("end",), tag=("{*}place", "{*}transition", "{*}arc")):
+                tag = etree.QName(el).localname
+
+                if tag == "place":
+                    pid = sys.intern(el.get("id"))
+                    init_mk = el.findtext("{*}initialMarking/{*}text")
+                    has_token = (init_mk is not None and init_mk.strip() == "1")
+                    model.places[pid] = Place(pid, marked=has_token)
+                elif tag == "transition":
+                    tid = sys.intern(el.get("id"))
+                    model.transitions[tid] = Transition(tid)
+                else:
+                    model.arcs.append((sys.intern(el.get("source")), sys.intern(el.get("target"))))
+
+                # Free the element and the already-processed siblings before it
+                el.clear(keep_tail=True)
+                while el.getprevious() is not None:
+                    del el.getparent()[0]
         except Exception as e:
             print("Error while parsing PNML:", e)
             return None
 
-        # Detect namespace
-        ns = xml.nsmap.get(None, "http://www.pnml.org/version-2009/grammar/pnml")
-
-        # Parse places
-        for p in xml.xpath(".//ns:place", namespaces={"ns": ns}):
-            pid = p.get("id")
-            init_mk = p.xpath(".//ns:initialMarking/ns:text/text()", namespaces={"ns": ns})
-            has_token = (init_mk and init_mk[0].strip() == "1")
-            model.places[pid] = Place(pid, marked=has_token)
-
-        # Parse transitions
-        for t in xml.xpath(".//ns:transition", namespaces={"ns": ns}):
-            tid = t.get("id")
-            model.transitions[tid] = Transition(tid)
-
-        # Parse arcs
-        for a in xml.xpath(".//ns:arc", namespaces={"ns": ns}):
-            src = a.get("source")
-            tgt = a.get("target")
-            model.arcs.append((src, tgt))
-
-        # Build input/output relations
-        for src, tgt in model.arcs:
-            if src in model.places and tgt in model.transitions:
-                model.places[src].outputs.append(tgt)
-                model.transitions[tgt].inputs.append(src)
-            elif src in model.transitions and tgt in model.places:
-                model.transitions[src].outputs.append(tgt)
-                model.places[tgt].inputs.append(src)
+        # Classify arcs by direction (arcs may precede their nodes in the file,
+        # so this happens after parsing); arcs with unknown endpoints are dropped
+        places, transitions = model.places, model.transitions
+        p2t_arcs, t2p_arcs = [], []
+        p2t_append, t2p_append = p2t_arcs.append, t2p_arcs.append
+        for arc in model.arcs:
+            src, tgt = arc
+            if src in places:
+                if tgt in transitions:
+                    p2t_append(arc)
+            elif src in transitions and tgt in places:
+                t2p_append(arc)
+
+        # Build input/output relations, one side of the graph per loop
+        for pid, tid in p2t_arcs:
+            places[pid].outputs.append(tid)
+            transitions[tid].inputs.append(pid)
+        for tid, pid in t2p_arcs:
+            transitions[tid].outputs.append(pid)
+            places[pid].inputs.append(tid)
+
+        model.freeze()
 
         print("PNML parsed successfully.")
         print(f"Places: {len(model.places)} | Transitions: {len(model.transitions)} | Arcs: {len(model.arcs)}")
@@ -3,12 +3,26 @@ Task 3 Experimental Results Generator
 Run symbolic BDD analysis on multiple models and generate comparison data
 """
 
+import hashlib
+import os
+import sys
 import time
 from pnml_parser import PNModel
-from symbolic import SymbolicAnalyzer
 
 
-def run_experiment(filename):
+BDD_CACHE_DIR = ".bddcache"
+
+
+def bdd_cache_path(filename, analyzer):
+    """Cache file for a model, keyed on the PNML contents and the BDD variable order"""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        digest.update(f.read())
+    digest.update("\0".join(analyzer.variable_order()).encode())
+    return os.path.join(BDD_CACHE_DIR, f"{digest.hexdigest()[:16]}.json")
+
+
+def run_experiment(filename, use_cache=False):
     """Run Task 3 analysis on a single model and return metrics"""
     print(f"\n{'='*70}")
     print(f"Analyzing: {filename}")
@@ -20,9 +34,11 @@ def run_experiment(filename):
         print("Failed to load model!")
         return None
     
-    # Run symbolic analysis
+    # Run symbolic analysis (imported here: dd is only needed once a model loaded)
+    from symbolic import SymbolicAnalyzer
     analyzer = SymbolicAnalyzer(model)
-    results = analyzer.analyze()
+    cache_path = bdd_cache_path(filename, analyzer) if use_cache else None
+    results = analyzer.analyze(cache_path=cache_path)
     analyzer.print_results(results)
     
     return {
@@ -36,6 +52,18 @@ def run_experiment(filename):
     }
 
 
+def format_summary_row(r):
+    """One fixed-width row of the summary table (shared by console and file output)"""
+    return (f"{r['filename']:<20} {r['places']:<8} {r['transitions']:<8} "
+            f"{r['reachable_markings']:<10} {r['bdd_nodes']:<12} {r['time_seconds']:<12.6f}")
+
+
+def write_rows(rows):
+    """Emit pre-formatted lines with a single write instead of one print per row"""
+    if rows:
+        sys.stdout.write("\n".join(rows) + "\n")
+
+
 def print_experiment_summary(all_results):
     """Print a comprehensive summary table of all experiments"""
     print("\n" + "="*80)
@@ -45,9 +73,7 @@ def print_experiment_summary(all_results):
     print(f"\n{'Model':<20} {'Places':<8} {'Trans':<8} {'States':<10} {'BDD Nodes':<12} {'Time (s)':<12}")
     print("-" * 80)
     
-    for r in all_results:
-        print(f"{r['filename']:<20} {r['places']:<8} {r['transitions']:<8} "
-              f"{r['reachable_markings']:<10} {r['bdd_nodes']:<12} {r['time_seconds']:<12.6f}")
+    write_rows([format_summary_row(r) for r in all_results])
     
     print("="*80)
     
@@ -56,21 +82,25 @@ def print_experiment_summary(all_results):
     print("-" * 80)
     
     # Find models with best BDD compression
+    rows = []
     for r in all_results:
         if r['reachable_markings'] > 0:
             compression_ratio = r['reachable_markings'] / r['bdd_nodes'] if r['bdd_nodes'] > 0 else 1
-            print(f"{r['filename']:<20} Compression: {compression_ratio:.2f}x "
-                  f"({r['reachable_markings']} states in {r['bdd_nodes']} BDD nodes)")
+            rows.append(f"{r['filename']:<20} Compression: {compression_ratio:.2f}x "
+                        f"({r['reachable_markings']} states in {r['bdd_nodes']} BDD nodes)")
+    write_rows(rows)
     
     # Scalability
     print("\nSCALABILITY ANALYSIS:")
     print("-" * 80)
+    rows = []
     for i, r in enumerate(all_results):
         if i > 0:
             prev = all_results[i-1]
             state_growth = r['reachable_markings'] / prev['reachable_markings'] if prev['reachable_markings'] > 0 else 0
             time_growth = r['time_seconds'] / prev['time_seconds'] if prev['time_seconds'] > 0 else 0
-            print(f"{r['filename']:<20} State growth: {state_growth:.2f}x | Time growth: {time_growth:.2f}x")
+            rows.append(f"{r['filename']:<20} State growth: {state_growth:.2f}x | Time growth: {time_growth:.2f}x")
+    write_rows(rows)
     
     print("\n" + "="*80)
 
@@ -88,10 +118,13 @@ def generate_latex_table(all_results):
     print("\\textbf{Model} & \\textbf{Places} & \\textbf{Trans.} & \\textbf{States} & \\textbf{BDD Nodes} & \\textbf{Time (s)} \\\\")
     print("\\hline")
     
+    rows = []
     for r in all_results:
-        print(f"{r['filename'].replace('_', '\\_'):<20} & {r['places']} & {r['transitions']} & "
-              f"{r['reachable_markings']} & {r['bdd_nodes']} & {r['time_seconds']:.6f} \\\\")
-        print("\\hline")
+        name = r['filename'].replace('_', '\\_')
+        rows.append(f"{name:<20} & {r['places']} & {r['transitions']} & "
+                    f"{r['reachable_markings']} & {r['bdd_nodes']} & {r['time_seconds']:.6f} \\\\")
+        rows.append("\\hline")
+    write_rows(rows)
     
     print("\\end{tabular}")
     print("\\label{tab:task3_results}")
@@ -114,12 +147,17 @@ def main():
         
     ]
     
+    # --cache: reuse reachable-set BDDs dumped by a previous run (time and node
+    # count are those recorded when the BDD was computed)
+    use_cache = "--cache" in sys.argv[1:]
+    
     all_results = []
     
-    # Run experiments
+    # Run experiments one after another: time_seconds must not be skewed by
+    # other analyses competing for CPU and memory
     for model_file in test_models:
         try:
-            result = run_experiment(model_file)
+            result = run_experiment(model_file, use_cache)
             if result:
                 all_results.append(result)
         except FileNotFoundError:
@@ -146,9 +184,7 @@ def main():
         f.write(f"{'Model':<20} {'Places':<8} {'Trans':<8} {'States':<10} {'BDD Nodes':<12} {'Time (s)':<12}\n")
         f.write("-" * 80 + "\n")
         
-        for r in all_results:
-            f.write(f"{r['filename']:<20} {r['places']:<8} {r['transitions']:<8} "
-                   f"{r['reachable_markings']:<10} {r['bdd_nodes']:<12} {r['time_seconds']:<12.6f}\n")
+        f.writelines(format_summary_row(r) + "\n" for r in all_results)
         
         f.write("\n" + "="*80 + "\n")
         f.write(f"\nTotal models tested: {len(all_results)}\n")
@@ -6,10 +6,25 @@ This module provides symbolic state space exploration using BDDs,
 which is more efficient for large Petri nets.
 """
 
-from dd.autoref import BDD
+try:
+    # CUDD-backed manager (C implementation, same API); needs dd built with CUDD
+    from dd.cudd import BDD
+except ImportError:
+    # Pure-Python reference implementation
+    from dd.autoref import BDD
+from functools import reduce
+import json
+import operator
+import os
+import sys
 import time
 from pnml_parser import PNModel
 
+# Sift variables when the manager has grown by this factor since the last reorder
+REORDER_GROWTH = 1.5
+# ... but never for managers smaller than this (sifting cost outweighs the gain)
+REORDER_MIN_NODES = 1000
+
 
 class SymbolicAnalyzer:
     """
@@ -19,31 +34,102 @@ class SymbolicAnalyzer:
     symbolically using BDDs, providing a compact representation of the state space.
     """
     
-    def __init__(self, model):
+    def __init__(self, model, reordering=True):
         """
         Initialize symbolic analyzer with a Petri net model.
         
         Args:
             model: PNModel object from Task 1 (pnml-parser.py)
+            reordering: enable dynamic variable reordering (sifting)
         """
         self.model = model
         self.bdd = BDD()
+        self.reordering = reordering
+        self.bdd.configure(reordering=reordering)
         self.place_vars = {}  # Maps place_id -> BDD variable name
+        self.literals = {}    # Maps place_id -> (var node, negated var node)
+        self.next_vars = {}   # Maps place_id -> primed (next-state) BDD variable name
+        self.next_literals = {}  # Maps place_id -> (primed var node, negated primed var node)
+        self.enable_cubes = {}  # Maps transition_id -> cube AND_{p in pre} x_p
+        self.effect_cubes = {}  # Maps transition_id -> cube of x' literals fixed by firing
+        self.relations = {}   # Maps transition_id -> transition relation T_t(x, x')
+        self.transition_relation = None  # Monolithic next-state relation T = OR_t T_t
         self.reachable_bdd = None
         self.num_reachable = 0
         
+    def variable_order(self):
+        """
+        Return place IDs in BDD variable order (top level first).
+        
+        Heuristic: Cuthill-McKee ordering of the place graph, where two places
+        are adjacent iff some transition has both in its pre- or post-set.
+        Places that interact through a transition end up close together, which
+        keeps the BDDs (and the transition relations) small. Each connected
+        component is traversed breadth-first from an initially marked place
+        (else its lowest-degree place), visiting neighbours by increasing
+        degree; ties are broken by place ID so the order is deterministic.
+        """
+        neighbours = {place_id: set() for place_id in self.model.sorted_places}
+        for t in self.model.transitions.values():
+            connected = t.inputs | t.outputs
+            for place_id in connected:
+                neighbours[place_id].update(connected)
+        for place_id, adjacent in neighbours.items():
+            adjacent.discard(place_id)
+        
+        def by_degree(place_id):
+            return (len(neighbours[place_id]), place_id)
+        
+        # Component roots: marked places first, then by increasing degree
+        roots = sorted(self.model.sorted_places,
+                       key=lambda p: (not self.model.places[p].marked, len(neighbours[p]), p))
+        
+        order = []
+        visited = set()
+        for root in roots:
+            if root in visited:
+                continue
+            visited.add(root)
+            level = [root]
+            while level:
+                order.extend(level)
+                next_level = []
+                for place_id in level:
+                    for adjacent in sorted(neighbours[place_id] - visited, key=by_degree):
+                        visited.add(adjacent)
+                        next_level.append(adjacent)
+                level = next_level
+        
+        return order
+    
     def initialize_bdd_variables(self):
         """
         Create BDD variables for each place in the Petri net.
-        For 1-safe nets, each place needs one boolean variable.
+        For 1-safe nets, each place needs one boolean variable for the
+        current marking (x = "{place}_0") and one for the next marking
+        (x' = "{place}_1"), declared right after x so the frame condition
+        x' <-> x of every transition relation stays linear in size.
         """
-        # Sort places for consistent variable ordering
-        sorted_places = sorted(self.model.places.keys())
-        
-        for place_id in sorted_places:
-            var_name = f"{place_id}_0"
+        for place_id in self.variable_order():
+            # Interned: var names are dict keys in every assignment/let call
+            var_name = sys.intern(f"{place_id}_0")
+            next_name = sys.intern(f"{place_id}_1")
             self.bdd.add_var(var_name)
+            self.bdd.add_var(next_name)
             self.place_vars[place_id] = var_name
+            self.next_vars[place_id] = next_name
+            
+            # Build each literal once instead of on every encode/enable check
+            var = self.bdd.var(var_name)
+            self.literals[place_id] = (var, ~var)
+            next_var = self.bdd.var(next_name)
+            self.next_literals[place_id] = (next_var, ~next_var)
+        
+        # Quantified set and x' -> x renaming used by every image computation
+        self._current_vars = set(self.place_vars.values())
+        self._rename = {self.next_vars[p]: v for p, v in self.place_vars.items()}
+        
+        self.precompute_transition_cubes()
             
         print(f"Initialized {len(self.place_vars)} BDD variables")
     
@@ -57,20 +143,8 @@ class SymbolicAnalyzer:
         Returns:
             BDD node representing this marking
         """
-        # Create conjunction of literals
-        expr = self.bdd.true
-        
-        for place_id in self.model.places:
-            var_name = self.place_vars[place_id]
-            
-            if place_id in marking:
-                # Place has token
-                expr = expr & self.bdd.var(var_name)
-            else:
-                # Place has no token
-                expr = expr & ~self.bdd.var(var_name)
-        
-        return expr
+        # Single cube: place has token -> positive literal, otherwise negated literal
+        return self.bdd.cube({var_name: place_id in marking for place_id, var_name in self.place_vars.items()})
     
     def bdd_to_markings(self, bdd_node):
         """
@@ -85,19 +159,14 @@ class SymbolicAnalyzer:
         if bdd_node == self.bdd.false:
             return set()
         
-        markings = set()
-        
-        # Get all satisfying assignments - consume iterator immediately
-        assignments = list(self.bdd.pick_iter(bdd_node))
-        
-        for assignment in assignments:
-            marking = set()
-            for place_id, var_name in self.place_vars.items():
-                if assignment.get(var_name, False):
-                    marking.add(place_id)
-            markings.add(frozenset(marking))
-        
-        return markings
+        # care_vars: places outside the BDD's support are expanded to both values
+        # (otherwise pick_iter leaves them out and they would read as unmarked)
+        items = tuple(self.place_vars.items())
+        care_vars = {var_name for _, var_name in items}
+        return {
+            frozenset(place_id for place_id, var_name in items if assignment[var_name])
+            for assignment in self.bdd.pick_iter(bdd_node, care_vars=care_vars)
+        }
     
     def is_enabled_bdd(self, marking_set, tid):
         """
@@ -110,21 +179,54 @@ class SymbolicAnalyzer:
         Returns:
             BDD representing markings where transition is enabled
         """
-        t = self.model.transitions[tid]
+        # Return markings that satisfy the enabling condition
+        return marking_set & self.enable_cubes[tid]
+    
+    def precompute_transition_cubes(self):
+        """
+        Build, once per transition, the enabling cube (all input places marked)
+        and the effect cube on next-state variables (input places emptied,
+        output places marked).
+        """
+        for tid in self.model.sorted_transitions:
+            t = self.model.transitions[tid]
+            self.enable_cubes[tid] = self.bdd.cube({self.place_vars[p]: True for p in t.inputs})
+            
+            # Outputs override inputs: a token consumed and produced stays
+            effect = {self.next_vars[p]: False for p in t.inputs}
+            effect.update({self.next_vars[p]: True for p in t.outputs})
+            self.effect_cubes[tid] = self.bdd.cube(effect)
+    
+    def build_transition_relations(self):
+        """
+        Build the transition relation T_t(x, x') of every transition once:
         
-        # Build enabling condition: all input places must have tokens
-        enable = self.bdd.true
-        for place_id in t.inputs:
-            var_name = self.place_vars[place_id]
-            enable = enable & self.bdd.var(var_name)
+            T_t = AND_{p in pre} x_p
+                & AND_{p in post} x'_p
+                & AND_{p in pre - post} ~x'_p
+                & AND_{p not in pre | post} (x'_p <-> x_p)
+        """
+        for tid in self.model.sorted_transitions:
+            t = self.model.transitions[tid]
+            relation = self.enable_cubes[tid] & self.effect_cubes[tid]
+            
+            # Frame condition: untouched places keep their value
+            for place_id in self.place_vars:
+                if place_id not in t.inputs and place_id not in t.outputs:
+                    relation &= self.bdd.apply('equiv', self.next_literals[place_id][0], self.literals[place_id][0])
+            
+            self.relations[tid] = relation
         
-        # Return markings that satisfy the enabling condition
-        return marking_set & enable
+        # One relation for the whole net: a single relational product per step
+        # lets the transitions share sub-BDDs and the operation cache
+        self.transition_relation = reduce(operator.or_, self.relations.values(), self.bdd.false)
     
     def compute_image(self, marking_set, tid):
         """
         Compute the symbolic image: all markings reachable by firing transition.
         
+        Relational product: Img = (EXISTS x. marking_set(x) & T_t(x, x'))[x' := x]
+        
         Args:
             marking_set: BDD representing a set of markings
             tid: Transition ID to fire
@@ -132,40 +234,50 @@ class SymbolicAnalyzer:
         Returns:
             BDD representing successor markings
         """
-        t = self.model.transitions[tid]
-        
-        # Get markings where transition is enabled
-        enabled_states = self.is_enabled_bdd(marking_set, tid)
+        successors = self.bdd.exist(self._current_vars, marking_set & self.relations[tid])
         
-        if enabled_states == self.bdd.false:
-            return self.bdd.false
+        if successors == self.bdd.false:
+            return successors
         
-        # Compute successors - consume iterator immediately
-        result = self.bdd.false
-        assignments = list(self.bdd.pick_iter(enabled_states))
+        # Rename next-state variables back to current-state variables
+        return self.bdd.let(self._rename, successors)
+    
+    def compute_successors(self, marking_set):
+        """
+        Compute the image of a set of markings under all transitions at once,
+        using the monolithic relation T.
         
-        for assignment in assignments:
-            # Create new marking by firing transition
-            new_marking = set()
-            
-            # Copy current marking
-            for place_id, var_name in self.place_vars.items():
-                if assignment.get(var_name, False):
-                    new_marking.add(place_id)
-            
-            # Remove tokens from input places
-            for place_id in t.inputs:
-                new_marking.discard(place_id)
-            
-            # Add tokens to output places
-            for place_id in t.outputs:
-                new_marking.add(place_id)
+        Args:
+            marking_set: BDD representing a set of markings
             
-            # Encode new marking as BDD and add to result
-            new_bdd = self.marking_to_bdd(frozenset(new_marking))
-            result = result | new_bdd
+        Returns:
+            BDD representing successor markings
+        """
+        successors = self.bdd.exist(self._current_vars, marking_set & self.transition_relation)
+        return self.bdd.let(self._rename, successors)
+    
+    def compute_deadlocks(self, marking_set):
+        """
+        Compute the dead markings of a set directly: markings where no
+        transition is enabled, i.e. marking_set & ~OR_t enable_t.
         
-        return result
+        Args:
+            marking_set: BDD representing a set of markings
+            
+        Returns:
+            BDD representing the dead markings in the set
+        """
+        # Trivial cases, O(|T|): no transitions -> everything is dead;
+        # a transition without input places is always enabled -> nothing is
+        if not self.enable_cubes:
+            return marking_set
+        # Terminals fetched once (each access builds a new handle with dd.cudd)
+        true, false = self.bdd.true, self.bdd.false
+        if any(cube == true for cube in self.enable_cubes.values()):
+            return false
+        
+        any_enabled = reduce(operator.or_, self.enable_cubes.values(), false)
+        return marking_set & ~any_enabled
     
     def compute_reachability(self):
         """
@@ -176,56 +288,109 @@ class SymbolicAnalyzer:
         """
         print("\nComputing reachability symbolically (BDD)...")
         
-        # Initialize BDD variables
+        # Initialize BDD variables and transition relations
         self.initialize_bdd_variables()
+        self.build_transition_relations()
         
         # Initial marking: places that are marked
         M0 = frozenset(p for p in self.model.places if self.model.places[p].marked)
         print(f"Initial marking: {sorted(M0)}")
         
         # Encode initial marking as BDD
-        reach = self.marking_to_bdd(M0)
+        reach = frontier = self.marking_to_bdd(M0)
         
-        # Fixed-point iteration
+        # Fixed-point iteration (breadth-first): only the markings discovered in
+        # the previous step are expanded, so each state's image is computed once
         iteration = 0
+        reorder_threshold = max(REORDER_MIN_NODES, len(self.bdd))
+        false = self.bdd.false
         while True:
             iteration += 1
-            old_reach = reach
             
-            # Compute image under all transitions
-            new_states = self.bdd.false
-            for tid in self.model.transitions:
-                img = self.compute_image(reach, tid)
-                new_states = new_states | img
-            
-            # Add new states
-            reach = reach | new_states
+            # New markings: successors of the frontier not seen before
+            frontier = self.compute_successors(frontier) & ~reach
             
             # Check for fixed point
-            if reach == old_reach:
+            if frontier == false:
                 print(f"Fixed point reached after {iteration} iterations")
                 break
+            
+            reach = reach | frontier
+            
+            # Sift when the diagram grew a lot: the static order may be poor
+            if self.reordering and len(self.bdd) >= REORDER_GROWTH * reorder_threshold:
+                if hasattr(self.bdd, "collect_garbage"):
+                    # dd.autoref only; CUDD collects garbage on its own
+                    self.bdd.collect_garbage()
+                self.bdd.reorder()
+                reorder_threshold = max(REORDER_MIN_NODES, len(self.bdd))
         
         self.reachable_bdd = reach
         
-        # Count reachable markings
-        self.num_reachable = self.bdd.count(reach, len(self.place_vars))
+        # Count reachable markings (int(): dd.cudd returns the count as a float)
+        self.num_reachable = int(self.bdd.count(reach, len(self.place_vars)))
+        
+        return reach
+    
+    def load_reachability(self, path):
+        """
+        Load a previously dumped reachable-set BDD instead of recomputing it.
+        
+        Args:
+            path: file written by analyze(cache_path=...)
+            
+        Returns:
+            BDD representing all reachable markings
+        """
+        print(f"\nLoading reachable set from BDD cache: {path}")
+        
+        self.initialize_bdd_variables()
+        reach, = self.bdd.load(path)
+        
+        self.reachable_bdd = reach
+        self.num_reachable = int(self.bdd.count(reach, len(self.place_vars)))
         
         return reach
     
-    def analyze(self):
+    def analyze(self, cache_path=None):
         """
         Perform complete symbolic analysis.
         
+        Args:
+            cache_path: optional JSON file; if it exists the reachable set is
+                loaded from it, otherwise it is written there after computing.
+                The metrics of the run that computed it (time, node count) are
+                kept next to it and reported on a cache hit
+        
         Returns:
             Dictionary with analysis results
         """
-        start_time = time.time()
-        
-        # Compute reachability
-        reachable_bdd = self.compute_reachability()
+        metrics_path = os.path.splitext(cache_path)[0] + ".metrics.json" if cache_path else None
+        
+        # Compute reachability (or load it from the cache). Loading neither takes
+        # the analysis time nor builds the transition relations, so a hit reports
+        # the metrics stored by the run that computed the set
+        if cache_path and os.path.exists(cache_path) and os.path.exists(metrics_path):
+            reachable_bdd = self.load_reachability(cache_path)
+            with open(metrics_path) as f:
+                metrics = json.load(f)
+        else:
+            start_time = time.time()
+            reachable_bdd = self.compute_reachability()
+            metrics = {
+                'time_seconds': time.time() - start_time,
+                'bdd_node_count': len(self.bdd)
+            }
+            
+            if cache_path:
+                os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+                self.bdd.dump(cache_path, roots=[reachable_bdd])
+                with open(metrics_path, 'w') as f:
+                    json.dump(metrics, f)
         
-        end_time = time.time()
+        # Dead reachable markings (one BDD operation, no enumeration)
+        deadlock_bdd = self.compute_deadlocks(reachable_bdd)
+        num_deadlocks = int(self.bdd.count(deadlock_bdd, len(self.place_vars)))
         
         # Extract markings if state space is small enough
         if self.num_reachable <= 1000:
@@ -239,8 +404,9 @@ class SymbolicAnalyzer:
             'reachable_bdd': reachable_bdd,
             'reachable_markings': reachable_markings,
             'num_markings': self.num_reachable,
-            'time_seconds': end_time - start_time,
-            'bdd_node_count': len(self.bdd)
+            'num_deadlocks': num_deadlocks,
+            'time_seconds': metrics['time_seconds'],
+            'bdd_node_count': metrics['bdd_node_count']
         }
         
         return results
@@ -251,17 +417,20 @@ class SymbolicAnalyzer:
         print("SYMBOLIC REACHABILITY ANALYSIS (BDD)")
         print(f"{'='*60}")
         print(f"Number of reachable markings: {results['num_markings']}")
+        print(f"Number of deadlock markings: {results['num_deadlocks']}")
         print(f"BDD node count: {results['bdd_node_count']}")
         print(f"Computation time: {results['time_seconds']:.6f} seconds")
         
-        if results['reachable_markings'] and len(results['reachable_markings']) <= 20:
-            print("\nAll reachable markings:")
-            for marking in sorted(results['reachable_markings'], key=lambda m: sorted(m)):
-                print(f"  {sorted(marking)}")
-        elif results['reachable_markings']:
-            print(f"\n(Showing first 10 of {len(results['reachable_markings'])} markings)")
-            for marking in sorted(results['reachable_markings'], key=lambda m: sorted(m))[:10]:
-                print(f"  {sorted(marking)}")
+        if results['reachable_markings']:
+            # Sort each marking once and reuse it both as sort key and for printing
+            rows = sorted(sorted(marking) for marking in results['reachable_markings'])
+            if len(rows) <= 20:
+                print("\nAll reachable markings:")
+            else:
+                print(f"\n(Showing first 10 of {len(rows)} markings)")
+                rows = rows[:10]
+            for row in rows:
+                print(f"  {row}")
         
         print(f"{'='*60}\n")
 